@@ -1,39 +1,42 @@
-"""LangGraph agent with Schema RAG (Voyage + Atlas Vector Search). Query-example RAG is disabled for speed."""
-from typing import Annotated, Dict, List, Literal
+"""LangGraph agent with Schema RAG and query-example RAG (Voyage + Atlas Vector Search), retrieved in one round-trip."""
+import functools
+import threading
+from typing import Annotated, Any, Dict, List, Literal
 from typing_extensions import TypedDict
 
 from langchain_anthropic import ChatAnthropic
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode
 
 from config import get_database, ANTHROPIC_API_KEY
 from tools import get_all_tools
-from rag import retrieve_schema_context
+from rag import retrieve_all_contexts
 
 
 class AgentState(TypedDict):
     messages: Annotated[List[BaseMessage], add_messages]
+    # RAG context for the current turn; retrieved on the first agent pass and reused after tool calls.
+    schema_ctx: str | None
+    examples_ctx: str | None
 
 
 BASE_SYSTEM = """You are a MongoDB expert. You help users query the database named "inferyx" by understanding their natural language prompt and using the following tools:
 
 1. list_collections - Call this first to see which collections exist.
-2. get_collection_schema - Call this to see field names and types for one or more collections. For questions that need a JOIN between two collections, get schema for both collections to identify the local and foreign key fields for $lookup.
-3. execute_find - Run a simple find query on a single collection (filter and optional projection). Use when the user wants to list or filter documents from one collection.
-4. execute_aggregation - Run an aggregation pipeline. Use for: grouping, counting, sorting, or JOINing two collections with $lookup. For a join, use a stage like: {{"$lookup": {{"from": "other_collection", "localField": "field_in_this_collection", "foreignField": "_id", "as": "joined_docs"}}}}.
+2. get_collection_schema - Call this to see field names and types for one collection.
+3. get_collection_schemas - Call this to see field names and types for several collections in one call. For questions that need a JOIN between two collections, use it to get the schema of both collections and identify the local and foreign key fields for $lookup.
+4. execute_find - Run a simple find query on a single collection (filter and optional projection). Use when the user wants to list or filter documents from one collection.
+5. execute_aggregation - Run an aggregation pipeline. Use for: grouping, counting, sorting, or JOINing two collections with $lookup. For a join, use a stage like: {"$lookup": {"from": "other_collection", "localField": "field_in_this_collection", "foreignField": "_id", "as": "joined_docs"}}.
 
 Always use the tools to answer. Use any relevant schema provided below to prioritize collections and query shape. Then call tools as needed. For "join" or "combine data from two collections", use execute_aggregation with a $lookup stage. Return the final tool result as the answer to the user."""
 
 
 def _get_last_user_text(messages: List[BaseMessage]) -> str:
     """Return the content of the most recent HumanMessage."""
-    for m in reversed(messages):
-        if isinstance(m, HumanMessage) and hasattr(m, "content") and m.content:
-            return m.content if isinstance(m.content, str) else str(m.content)
-    return ""
+    content = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage) and m.content), "")
+    return content if isinstance(content, str) else str(content)
 
 
 def _create_agent(db):
@@ -45,24 +48,19 @@ def _create_agent(db):
     tools = get_all_tools(db)
     llm_with_tools = llm.bind_tools(tools)
 
-    # System message is dynamic: base + RAG context (schema + query examples)
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "{{system}}"),
-        MessagesPlaceholder(variable_name="messages"),
-    ])
-
-    chain = prompt | llm_with_tools
-
-    def agent_node(state: AgentState) -> Dict[str, List[BaseMessage]]:
+    def agent_node(state: AgentState) -> Dict[str, Any]:
         messages = state["messages"]
-        user_text = _get_last_user_text(messages)
-        schema_ctx = retrieve_schema_context(user_text, top_k=8) if user_text else ""
-        system_parts = [BASE_SYSTEM]
-        if schema_ctx:
-            system_parts.append("\n\n" + schema_ctx)
-        full_system = "".join(system_parts)
-        response = chain.invoke({"system": full_system, "messages": messages})
-        return {"messages": [response]}
+        schema_ctx = state.get("schema_ctx")
+        examples_ctx = state.get("examples_ctx")
+        if schema_ctx is None or examples_ctx is None:
+            user_text = _get_last_user_text(messages)
+            schema_ctx, examples_ctx = retrieve_all_contexts(user_text, 8, 3)
+        # System message is dynamic: base + RAG context (schema + query examples). It is passed as a
+        # ready-made SystemMessage, so no prompt template is parsed or formatted per call.
+        rag_ctx = "\n\n".join(c for c in (schema_ctx, examples_ctx) if c)
+        full_system = f"{BASE_SYSTEM}\n\n{rag_ctx}" if rag_ctx else BASE_SYSTEM
+        response = llm_with_tools.invoke([SystemMessage(content=full_system), *messages])
+        return {"messages": [response], "schema_ctx": schema_ctx, "examples_ctx": examples_ctx}
 
     tool_node = ToolNode(tools)
 
@@ -82,10 +80,24 @@ def _create_agent(db):
     return graph.compile()
 
 
+_app_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _compiled_app():
+    return _create_agent(get_database())
+
+
+def _get_compiled_app():
+    """Return the compiled agent graph, built once per process (the database handle is a singleton)."""
+    # lru_cache alone can build twice under concurrent Streamlit sessions; serialize the first build.
+    with _app_lock:
+        return _compiled_app()
+
+
 def run_agent(user_prompt: str) -> tuple[str, List[BaseMessage]]:
     """Run the agent with the given prompt. Returns (final_answer_text, list of messages)."""
-    db = get_database()
-    app = _create_agent(db)
+    app = _get_compiled_app()
     initial = {"messages": [HumanMessage(content=user_prompt)]}
     final_state = None
     for chunk in app.stream(initial, stream_mode="values"):
@@ -11,19 +11,46 @@ st.caption("Ask in plain English. The agent will discover schema, build find/agg
 if "history" not in st.session_state:
     st.session_state.history = []
 
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_run(prompt: str):
+    """Run the agent, reusing the result for identical prompts for 5 minutes."""
+    return run_agent(prompt)
+
+
+@st.fragment
+def _tool_trace(messages):
+    """Tool trace toggle; runs as a fragment so toggling it does not rerun the whole script."""
+    show_trace = st.checkbox("Show tool trace", value=False)
+    if show_trace and messages:
+        with st.expander("Tool trace (queries & tool results)"):
+            for m in messages:
+                if isinstance(m, AIMessage) and getattr(m, "tool_calls", None):
+                    for tc in m.tool_calls:
+                        st.code(
+                            f"Tool: {tc.get('name')}\nArgs: {tc.get('args')}",
+                            language="json",
+                        )
+                if isinstance(m, ToolMessage):
+                    content = m.content
+                    if len(content) > 2000:
+                        content = content[:2000] + "\n... (truncated)"
+                    st.text(content)
+                    st.divider()
+
+
 prompt = st.text_area(
     "Your question",
     placeholder="e.g. List all users. / How many orders per customer? / Join orders with users and show name and total.",
     height=120,
 )
-col1, col2, _ = st.columns([1, 1, 3])
+col1, _ = st.columns([1, 4])
 run = col1.button("Run", type="primary")
-show_trace = col2.checkbox("Show tool trace", value=False)
 
 if run and prompt.strip():
     with st.spinner("Thinking and querying..."):
         try:
-            final_text, messages = run_agent(prompt.strip())
+            final_text, messages = _cached_run(prompt.strip())
             st.session_state.last_result = (final_text, messages)
         except Exception as e:
             st.session_state.last_result = (None, None)
@@ -35,21 +62,7 @@ if run and prompt.strip():
         st.subheader("Answer")
         st.markdown(final_text)
 
-    if show_trace and messages:
-        with st.expander("Tool trace (queries & tool results)"):
-            for m in messages:
-                if isinstance(m, AIMessage) and getattr(m, "tool_calls", None):
-                    for tc in m.tool_calls:
-                        st.code(
-                            f"Tool: {tc.get('name')}\nArgs: {tc.get('args')}",
-                            language="json",
-                        )
-                if isinstance(m, ToolMessage):
-                    content = m.content
-                    if len(content) > 2000:
-                        content = content[:2000] + "\n... (truncated)"
-                    st.text(content)
-                    st.divider()
+    _tool_trace(messages)
 
 elif run and not prompt.strip():
     st.warning("Please enter a question.")
@@ -1,4 +1,5 @@
 """Configuration for MongoDB, LLM, Voyage AI, and RAG collections."""
+import functools
 import os
 from pymongo import MongoClient
 from dotenv import load_dotenv
@@ -19,14 +20,24 @@ QUERY_EXAMPLES_INDEX_NAME = "query_examples_vector_index"
 # Voyage embedding model (voyage-3 = 1024 dimensions)
 VOYAGE_EMBED_MODEL = "voyage-3"
 VECTOR_DIMENSION = 1024
+# Storage/query format of embeddings as BSON vectors: "int8" (scalar-quantized, 1 byte/dim) or "float32"
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "int8").strip().lower()
+if VECTOR_DTYPE not in ("int8", "float32"):
+    raise ValueError(f"VECTOR_DTYPE must be 'int8' or 'float32', got {VECTOR_DTYPE!r}")
 
 
+@functools.lru_cache(maxsize=1)
 def get_mongo_client() -> MongoClient:
-    """Return a MongoDB client."""
-    return MongoClient(MONGODB_URI, serverSelectionTimeoutMS=10000)
+    """Return the process-wide MongoDB client (created once; its connection pool is shared)."""
+    return MongoClient(
+        MONGODB_URI,
+        serverSelectionTimeoutMS=10000,
+        maxPoolSize=50,
+        # zlib ships with Python; zstd/snappy would need the zstandard/python-snappy packages.
+        compressors="zlib",
+    )
 
 
 def get_database():
     """Return the inferyx database."""
-    client = get_mongo_client()
-    return client[DB_NAME]
+    return get_mongo_client()[DB_NAME]
@@ -1,5 +1,9 @@
 """RAG module: Voyage embeddings, schema/metadata RAG, and query-example RAG."""
 from .embeddings import get_embedding, get_embeddings
-from .retrieval import retrieve_schema_context, retrieve_query_examples_context
+from .retrieval import (
+    retrieve_schema_context,
+    retrieve_query_examples_context,
+    retrieve_all_contexts,
+)
 from .schema_index import build_schema_index
 from .query_examples_index import build_query_examples_index, load_default_examples
@@ -1,16 +1,78 @@
 """Voyage AI embeddings for RAG."""
-from config import VOYAGE_API_KEY, VOYAGE_EMBED_MODEL
+import hashlib
+import threading
+
+from bson.binary import Binary, BinaryVectorDtype
+
+from config import VOYAGE_API_KEY, VOYAGE_EMBED_MODEL, VECTOR_DTYPE
+from ttl_cache import TTLCache
+
+
+# Conservative char budget per input (~4 chars/token against voyage-3's 32K-token context) so long
+# schema/example texts are cut here instead of being silently truncated or rejected by the API.
+MAX_EMBED_CHARS = 96_000
+
+
+def truncate_for_embedding(text: str) -> str:
+    """Cap text at MAX_EMBED_CHARS characters."""
+    return text if len(text) <= MAX_EMBED_CHARS else text[:MAX_EMBED_CHARS]
+
+
+# Stored-vector format recorded in content_hash; bump when the encoding changes so rebuilds re-store vectors.
+_VECTOR_FORMAT = "int8-absmax" if VECTOR_DTYPE == "int8" else VECTOR_DTYPE
+
+
+def content_hash(text: str) -> str:
+    """Stable hash of an indexed document's content together with the embedding model and vector dtype.
+    Stored as '_hash' so index rebuilds only re-embed documents whose hash changed."""
+    return hashlib.blake2b(f"{VOYAGE_EMBED_MODEL}:{_VECTOR_FORMAT}:{text}".encode(), digest_size=16).hexdigest()
+
+
+# Embedding vectors keyed by SHA-256 of (version salt + model + text). The salt is bumped on
+# invalidation so an embed that races with an index rebuild cannot repopulate a stale entry.
+_cache = TTLCache(max_size=512, ttl_seconds=600)
+_cache_version = 0
+
+
+def _cache_key(text: str) -> bytes:
+    return hashlib.sha256(f"{_cache_version}:{VOYAGE_EMBED_MODEL}{text}".encode()).digest()
+
+
+_voyage_client = None
+_voyage_lock = threading.Lock()
+
+
+def _get_voyage():
+    """Return the shared voyageai.Client, creating it on first use."""
+    global _voyage_client
+    if _voyage_client is None:
+        with _voyage_lock:
+            if _voyage_client is None:
+                import voyageai
+                _voyage_client = voyageai.Client(api_key=VOYAGE_API_KEY)
+    return _voyage_client
+
+
+def invalidate_embedding_cache() -> None:
+    """Discard all cached embeddings (called when RAG indexes are rebuilt)."""
+    global _cache_version
+    _cache_version += 1
+    _cache.clear()
 
 
 def get_embedding(text: str) -> list[float]:
     """Return the Voyage embedding vector for a single text. Returns empty list if API key missing or error."""
     if not text or not VOYAGE_API_KEY:
         return []
+    key = _cache_key(text)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
     try:
-        import voyageai
-        vo = voyageai.Client(api_key=VOYAGE_API_KEY)
+        vo = _get_voyage()
         result = vo.embed([text], model=VOYAGE_EMBED_MODEL)
         if result.embeddings:
+            _cache.put(key, result.embeddings[0])
             return result.embeddings[0]
     except Exception:
         pass
@@ -18,13 +80,43 @@ def get_embedding(text: str) -> list[float]:
 
 
 def get_embeddings(texts: list[str]) -> list[list[float]]:
-    """Return Voyage embedding vectors for a list of texts. Missing/errors yield empty vectors for that slot."""
+    """Return Voyage embedding vectors for a list of texts. Missing/errors yield empty vectors for that slot.
+    Cached texts are served from the in-process cache; only misses are sent to Voyage."""
     if not texts or not VOYAGE_API_KEY:
         return [[]] * len(texts) if texts else []
+    out: list[list[float]] = [[] for _ in texts]
+    keys = [_cache_key(text) for text in texts]
+    missing = []
+    for i, text in enumerate(texts):
+        cached = _cache.get(keys[i]) if text else None
+        if cached is not None:
+            out[i] = cached
+        else:
+            missing.append(i)
+    if not missing:
+        return out
     try:
-        import voyageai
-        vo = voyageai.Client(api_key=VOYAGE_API_KEY)
-        result = vo.embed(texts, model=VOYAGE_EMBED_MODEL)
-        return list(result.embeddings) if result.embeddings else [[]] * len(texts)
+        vo = _get_voyage()
+        result = vo.embed([texts[i] for i in missing], model=VOYAGE_EMBED_MODEL)
+        if not result.embeddings:
+            return out
+        for i, emb in zip(missing, result.embeddings):
+            out[i] = emb
+            if emb:
+                _cache.put(keys[i], emb)
     except Exception:
-        return [[]] * len(texts)
+        pass
+    return out
+
+
+def to_bson_vector(embedding: list[float]) -> Binary:
+    """Pack an embedding as a BSON vector (binData subtype 9) in the configured VECTOR_DTYPE.
+    Used both for stored documents and for $vectorSearch query vectors so they share one index format.
+    int8 scales each vector so its largest component maps to +/-127 (components of a unit-norm 1024-dim
+    vector are ~0.03, so a fixed x * 127 would use only a few dozen levels); the per-vector scale changes
+    magnitudes, so the index must use cosine similarity. float32 keeps full precision at 4 bytes/dim."""
+    if VECTOR_DTYPE == "float32":
+        return Binary.from_vector(embedding, BinaryVectorDtype.FLOAT32)
+    peak = max(map(abs, embedding), default=0.0)
+    scale = 127 / peak if peak else 0.0
+    return Binary.from_vector([round(x * scale) for x in embedding], BinaryVectorDtype.INT8)
@@ -1,8 +1,16 @@
 """Build the query-examples vector index for RAG (few-shot / documentation RAG)."""
 import json
 import os
+from pymongo import UpdateOne
 from config import get_database, QUERY_EXAMPLES_COLLECTION
-from .embeddings import get_embeddings
+from .embeddings import (
+    content_hash,
+    get_embeddings,
+    invalidate_embedding_cache,
+    to_bson_vector,
+    truncate_for_embedding,
+)
+from .retrieval import clear_context_cache
 
 
 def _example_to_text(ex: dict) -> str:
@@ -14,6 +22,13 @@ def _example_to_text(ex: dict) -> str:
     return f"Question: {nl}. Query: {q}"
 
 
+def _example_id(ex: dict) -> str:
+    """Stable upsert key for an example."""
+    nl = ex.get("natural_language") or ex.get("question") or ""
+    q = ex.get("query") or ex.get("example_query") or ""
+    return f"{nl[:80]}_{str(q)[:50]}"
+
+
 def load_default_examples() -> list[dict]:
     """Return built-in example (question, query) pairs for common patterns."""
     return [
@@ -75,7 +90,8 @@ def build_query_examples_index(examples: list[dict] | None = None, examples_file
     Embed each example (natural_language + query) and upsert into query_examples with 'embedding'.
     examples: list of dicts with keys e.g. natural_language, query (or question, pipeline).
     examples_file: optional path to JSON file with list of such dicts (merged with defaults if examples not provided).
-    Returns number of documents written.
+    Examples whose stored '_hash' matches are not re-embedded or rewritten.
+    Returns number of documents indexed (written or already up to date).
     """
     if examples is None:
         examples = load_default_examples()
@@ -86,26 +102,40 @@ def build_query_examples_index(examples: list[dict] | None = None, examples_file
             examples = examples + file_examples
     if not examples:
         return 0
-    texts = [_example_to_text(ex) for ex in examples]
-    embeddings = get_embeddings(texts)
+    invalidate_embedding_cache()
+    clear_context_cache()
+    texts = [truncate_for_embedding(_example_to_text(ex)) for ex in examples]
+    # Hash the full example too, so edits to non-embedded fields (e.g. 'tool') are still written
+    hashes = [content_hash(t + json.dumps(ex, sort_keys=True, default=str)) for t, ex in zip(texts, examples)]
+    sids = [_example_id(ex) for ex in examples]
     db = get_database()
     collection = db[QUERY_EXAMPLES_COLLECTION]
-    written = 0
-    for i, (ex, emb) in enumerate(zip(examples, embeddings)):
+    # Skip examples whose stored _hash matches: their embedding would be identical
+    existing = {
+        d["_rag_id"]: d.get("_hash")
+        for d in collection.find({"_rag_id": {"$in": sids}}, {"_id": 0, "_rag_id": 1, "_hash": 1})
+    }
+    changed = [i for i, (sid, h) in enumerate(zip(sids, hashes)) if existing.get(sid) != h]
+    unchanged = len(examples) - len(changed)
+    if not changed:
+        return unchanged
+    # Embed each distinct text once, then scatter back to every example that produced it
+    unique = list(dict.fromkeys(texts[i] for i in changed))
+    emb_map = dict(zip(unique, get_embeddings(unique)))
+    ops = []
+    for i in changed:
+        emb = emb_map[texts[i]]
         if not emb:
             continue
-        nl = ex.get("natural_language") or ex.get("question") or ""
-        q = ex.get("query") or ex.get("example_query") or ""
-        sid = f"{nl[:80]}_{str(q)[:50]}"
+        ex = examples[i]
         doc = {
-            "_rag_id": sid,
+            "_rag_id": sids[i],
             **{k: v for k, v in ex.items() if k != "embedding"},
-            "embedding": emb,
+            "embedding": to_bson_vector(emb),
+            "_hash": hashes[i],
         }
-        collection.update_one(
-            {"_rag_id": sid},
-            {"$set": doc},
-            upsert=True,
-        )
-        written += 1
-    return written
+        ops.append(UpdateOne({"_rag_id": sids[i]}, {"$set": doc}, upsert=True))
+    if not ops:
+        return unchanged
+    result = collection.bulk_write(ops, ordered=False)
+    return unchanged + result.upserted_count + result.matched_count
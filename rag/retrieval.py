@@ -1,4 +1,12 @@
 """Atlas Vector Search retrieval for schema and query-example RAG."""
+import functools
+import hashlib
+import inspect
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo.errors import OperationFailure
+
 from config import (
     get_database,
     SCHEMA_RAG_COLLECTION,
@@ -6,44 +14,145 @@ from config import (
     QUERY_EXAMPLES_COLLECTION,
     QUERY_EXAMPLES_INDEX_NAME,
 )
-from .embeddings import get_embedding
+from ttl_cache import TTLCache
+from .embeddings import get_embedding, to_bson_vector
+
+# Formatted context blocks, reused while the agent loops over tool calls for the same user turn.
+_context_cache = TTLCache(max_size=256, ttl_seconds=120)
+
+
+def _has_context(result) -> bool:
+    # Empty results usually mean a missing key or transient error; don't pin them.
+    return any(result) if isinstance(result, tuple) else bool(result)
+
+
+def _cached_context(fn):
+    """Memoize a retrieve_*_context function on (name, user_query, top-k arguments) with LRU eviction and TTL."""
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(user_query: str, *args, **kwargs):
+        bound = signature.bind(user_query, *args, **kwargs)
+        bound.apply_defaults()
+        top_k = tuple(bound.arguments.values())[1:]
+        key = (fn.__name__, hashlib.blake2b(user_query.encode()).digest(), *top_k)
+        return _context_cache.get_or_compute(key, lambda: fn(user_query, *top_k), cache_if=_has_context)
+
+    return wrapper
+
+
+def clear_context_cache() -> None:
+    """Drop all memoized retrieval results (called when RAG indexes are rebuilt)."""
+    _context_cache.clear()
+    _metadata_cache.clear()
+
+
+# Per-collection metadata used to size and pre-filter $vectorSearch (document counts, indexed
+# collection names). Indexes are usually rebuilt by scripts in another process, so in-process
+# invalidation is not enough; keep the TTL short.
+_metadata_cache = TTLCache(max_size=64, ttl_seconds=60)
+
+
+def _num_candidates(coll, limit: int) -> int:
+    """ANN candidate pool: ~10x the limit (min 50), capped at the collection size but never below limit."""
+    try:
+        count = _metadata_cache.get_or_compute(("count", coll.full_name), coll.estimated_document_count)
+    except Exception:
+        count = 0
+    candidates = max(limit * 10, 50)
+    if count:
+        candidates = min(candidates, count)
+    return max(candidates, limit)
+
+
+def _indexed_collection_names(db) -> list[str]:
+    """Collection names present in the schema RAG collection."""
+    try:
+        return _metadata_cache.get_or_compute(
+            ("names", db.name),
+            lambda: sorted(db[SCHEMA_RAG_COLLECTION].distinct("collection_name")),
+        )
+    except Exception:
+        return []
+
+
+def _mentioned_collections(names: list[str], user_query: str) -> list[str]:
+    """Return the names that appear as whole words in the user query."""
+    if not names:
+        return []
+    pattern = re.compile(r"\b(" + "|".join(re.escape(n) for n in names) + r")\b", re.IGNORECASE)
+    by_lower = {n.lower(): n for n in names}
+    return list(dict.fromkeys(by_lower[m.lower()] for m in pattern.findall(user_query)))
+
+
+# Allow-list of fields read by the retrieve_*_context formatters; everything else (embedding,
+# _id, _rag_id, extra example keys) stays on the server.
+_RESULT_PROJECTION = {
+    "_id": 0,
+    "text": 1,
+    "description": 1,
+    "collection_name": 1,
+    "collection": 1,
+    "natural_language": 1,
+    "question": 1,
+    "query": 1,
+    "pipeline": 1,
+    "example_query": 1,
+}
+
+
+def _vector_search_stage(coll, index_name: str, query_embedding: list[float], limit: int, filter: dict | None) -> dict:
+    """Build a $vectorSearch stage for coll. filter is an optional pre-filter; its fields must be
+    indexed as "filter" in the vector index."""
+    stage = {
+        "index": index_name,
+        "path": "embedding",
+        "queryVector": to_bson_vector(query_embedding),
+        "numCandidates": _num_candidates(coll, limit),
+        "limit": limit,
+    }
+    if filter:
+        stage["filter"] = filter
+    return {"$vectorSearch": stage}
+
 
+def _schema_filter(db, user_query: str, top_k: int) -> dict | None:
+    """Pre-filter schema search to collections named in the query, if any. Only applied when there are
+    more indexed collections than top_k: otherwise the unfiltered search already returns every schema
+    doc, and a name match (e.g. "datasource" in "datapods with their datasource") would just drop the rest."""
+    names = _indexed_collection_names(db)
+    if len(names) <= top_k:
+        return None
+    mentioned = _mentioned_collections(names, user_query)
+    return {"collection_name": {"$in": mentioned}} if mentioned else None
 
-def _vector_search(db, collection_name: str, index_name: str, query_embedding: list[float], limit: int = 5):
+
+def _vector_search(
+    db,
+    collection_name: str,
+    index_name: str,
+    query_embedding: list[float],
+    limit: int = 5,
+    filter: dict | None = None,
+):
     """Run Atlas $vectorSearch on the given collection. Returns list of docs (with score if present)."""
     if not query_embedding:
         return []
     coll = db[collection_name]
     pipeline = [
-        {
-            "$vectorSearch": {
-                "index": index_name,
-                "path": "embedding",
-                "queryVector": query_embedding,
-                "numCandidates": max(limit * 20, 100),
-                "limit": limit,
-            }
-        },
-        {"$project": {"embedding": 0}},  # drop vector to reduce payload
+        _vector_search_stage(coll, index_name, query_embedding, limit, filter),
+        {"$project": _RESULT_PROJECTION},
     ]
     try:
         return list(coll.aggregate(pipeline))
     except Exception:
+        if filter:
+            # Index built without the filter field: fall back to an unfiltered search.
+            return _vector_search(db, collection_name, index_name, query_embedding, limit)
         return []
 
 
-def retrieve_schema_context(user_query: str, top_k: int = 8) -> str:
-    """
-    Retrieve relevant schema/metadata chunks for the user query via Atlas Vector Search.
-    Returns a formatted string to inject into the agent system prompt.
-    """
-    db = get_database()
-    query_embedding = get_embedding(user_query)
-    if not query_embedding:
-        return ""
-    docs = _vector_search(db, SCHEMA_RAG_COLLECTION, SCHEMA_RAG_INDEX_NAME, query_embedding, limit=top_k)
-    if not docs:
-        return ""
+def _format_schema_docs(docs: list[dict]) -> str:
     lines = [
         "Relevant schema metadata (from vector search; use this to prioritize which collections/fields to use):",
         "",
@@ -56,18 +165,7 @@ def retrieve_schema_context(user_query: str, top_k: int = 8) -> str:
     return "\n".join(lines) if len(lines) > 2 else ""
 
 
-def retrieve_query_examples_context(user_query: str, top_k: int = 3) -> str:
-    """
-    Retrieve similar past query examples (natural language + query) via Atlas Vector Search.
-    Returns a formatted string to inject as few-shot context.
-    """
-    db = get_database()
-    query_embedding = get_embedding(user_query)
-    if not query_embedding:
-        return ""
-    docs = _vector_search(db, QUERY_EXAMPLES_COLLECTION, QUERY_EXAMPLES_INDEX_NAME, query_embedding, limit=top_k)
-    if not docs:
-        return ""
+def _format_example_docs(docs: list[dict]) -> str:
     lines = [
         "Similar example questions and how they were answered (use as reference for tool usage and query shape):",
         "",
@@ -81,3 +179,120 @@ def retrieve_query_examples_context(user_query: str, top_k: int = 3) -> str:
                 lines.append(f"  → {q}")
             lines.append("")
     return "\n".join(lines).strip() if len(lines) > 2 else ""
+
+
+@_cached_context
+def retrieve_schema_context(user_query: str, top_k: int = 8) -> str:
+    """
+    Retrieve relevant schema/metadata chunks for the user query via Atlas Vector Search.
+    Returns a formatted string to inject into the agent system prompt.
+    """
+    db = get_database()
+    query_embedding = get_embedding(user_query)
+    if not query_embedding:
+        return ""
+    docs = _vector_search(
+        db,
+        SCHEMA_RAG_COLLECTION,
+        SCHEMA_RAG_INDEX_NAME,
+        query_embedding,
+        limit=top_k,
+        filter=_schema_filter(db, user_query, top_k),
+    )
+    return _format_schema_docs(docs) if docs else ""
+
+
+@_cached_context
+def retrieve_query_examples_context(user_query: str, top_k: int = 3) -> str:
+    """
+    Retrieve similar past query examples (natural language + query) via Atlas Vector Search.
+    Returns a formatted string to inject as few-shot context.
+    """
+    db = get_database()
+    query_embedding = get_embedding(user_query)
+    if not query_embedding:
+        return ""
+    docs = _vector_search(db, QUERY_EXAMPLES_COLLECTION, QUERY_EXAMPLES_INDEX_NAME, query_embedding, limit=top_k)
+    return _format_example_docs(docs) if docs else ""
+
+
+# Cleared after the server rejects $vectorSearch inside $unionWith once.
+_union_search_supported = True
+
+
+def _disable_union_search() -> None:
+    global _union_search_supported
+    _union_search_supported = False
+
+
+def _is_union_search_rejected(error: OperationFailure) -> bool:
+    """True if the server refused $vectorSearch inside a $unionWith sub-pipeline (MongoDB < 8.0)."""
+    message = str(error)
+    return "$vectorSearch" in message and "$unionWith" in message
+
+
+def _union_pipeline(db, query_embedding: list[float], schema_k: int, examples_k: int, filter: dict | None) -> list[dict]:
+    """Schema $vectorSearch with the examples $vectorSearch attached via $unionWith; each doc is tagged with _src."""
+    return [
+        _vector_search_stage(db[SCHEMA_RAG_COLLECTION], SCHEMA_RAG_INDEX_NAME, query_embedding, schema_k, filter),
+        {"$addFields": {"_src": "schema"}},
+        {"$unionWith": {
+            "coll": QUERY_EXAMPLES_COLLECTION,
+            "pipeline": [
+                _vector_search_stage(
+                    db[QUERY_EXAMPLES_COLLECTION], QUERY_EXAMPLES_INDEX_NAME, query_embedding, examples_k, None
+                ),
+                {"$addFields": {"_src": "example"}},
+            ],
+        }},
+        {"$project": {**_RESULT_PROJECTION, "_src": 1}},
+    ]
+
+
+def _retrieve_contexts_separately(user_query: str, schema_k: int, examples_k: int) -> tuple[str, str]:
+    """Run the two per-collection retrievals concurrently (the query embedding is already cached)."""
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        schema_ctx = pool.submit(retrieve_schema_context, user_query, schema_k)
+        examples_ctx = pool.submit(retrieve_query_examples_context, user_query, examples_k)
+        return schema_ctx.result(), examples_ctx.result()
+
+
+@_cached_context
+def retrieve_all_contexts(user_query: str, schema_k: int = 8, examples_k: int = 3) -> tuple[str, str]:
+    """
+    Retrieve schema and query-example context in one MongoDB round-trip: embed once, then run the
+    schema $vectorSearch with the examples $vectorSearch attached via $unionWith.
+    Falls back to concurrent per-collection retrievals if the server rejects the combined pipeline.
+    Returns (schema_ctx, examples_ctx).
+    """
+    if not user_query:
+        return "", ""
+    query_embedding = get_embedding(user_query)
+    if not query_embedding:
+        return "", ""
+    if not _union_search_supported:
+        return _retrieve_contexts_separately(user_query, schema_k, examples_k)
+    db = get_database()
+    schema_coll = db[SCHEMA_RAG_COLLECTION]
+    filter = _schema_filter(db, user_query, schema_k)
+    try:
+        try:
+            docs = list(schema_coll.aggregate(_union_pipeline(db, query_embedding, schema_k, examples_k, filter)))
+        except OperationFailure as e:
+            if _is_union_search_rejected(e):
+                # Pre-8.0 cluster: use the per-collection searches from now on instead of failing every turn.
+                _disable_union_search()
+                return _retrieve_contexts_separately(user_query, schema_k, examples_k)
+            if not filter:
+                raise
+            # Schema index built without the collection_name filter field: retry once unfiltered.
+            docs = list(schema_coll.aggregate(_union_pipeline(db, query_embedding, schema_k, examples_k, None)))
+    except Exception:
+        return _retrieve_contexts_separately(user_query, schema_k, examples_k)
+    schema_docs = [d for d in docs if d.get("_src") == "schema"]
+    example_docs = [d for d in docs if d.get("_src") == "example"]
+    return (
+        _format_schema_docs(schema_docs) if schema_docs else "",
+        _format_example_docs(example_docs) if example_docs else "",
+    )
+
@@ -1,26 +1,47 @@
 """Build the schema/metadata vector index for RAG."""
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import UpdateOne
+
 from config import get_database, SCHEMA_RAG_COLLECTION
-from .embeddings import get_embeddings
+from schema_sampling import field_types_pipeline
+from ttl_cache import TTLCache
+from .embeddings import (
+    content_hash,
+    get_embeddings,
+    invalidate_embedding_cache,
+    to_bson_vector,
+    truncate_for_embedding,
+)
+from .retrieval import clear_context_cache
+
+# Short-lived memo of list_collection_names() per database to avoid repeated listCollections calls.
+_collection_names = TTLCache(max_size=16, ttl_seconds=5)
+
+
+def _list_collection_names(db) -> list[str]:
+    """Return db.list_collection_names(), memoized for a few seconds."""
+    return list(_collection_names.get_or_compute(db.name, db.list_collection_names))
 
 
 def _infer_schema_text(db, collection_name: str, sample_size: int = 3) -> str:
     """Produce a single searchable text blob for a collection (name + field names and types)."""
     coll = db[collection_name]
-    cursor = coll.find().limit(sample_size)
-    docs = list(cursor)
+    docs = list(coll.aggregate(field_types_pipeline(sample_size, max_keys=6)))
     if not docs:
         return f"Collection {collection_name} (empty)"
     parts = [f"Collection: {collection_name}. Fields:"]
     seen = set()
     for doc in docs:
-        for k, v in doc.items():
+        for f in doc["fields"]:
+            k = f["k"]
             if k in seen:
                 continue
             seen.add(k)
-            t = type(v).__name__
-            if isinstance(v, dict):
-                t += " (keys: " + ", ".join(list(v.keys())[:6]) + ")"
-            elif isinstance(v, list) and v and isinstance(v[0], dict):
+            t = f["t"]
+            if f.get("keys") is not None:
+                t += " (keys: " + ", ".join(f["keys"]) + ")"
+            elif f.get("elem_keys") is not None:
                 t += " (list of objects)"
             parts.append(f"  {k}: {t}")
     return "\n".join(parts)
@@ -30,31 +51,48 @@ def build_schema_index(sample_size: int = 3) -> int:
     """
     For each collection in the DB, build a schema text, embed it with Voyage, and upsert into
     schema_metadata with an 'embedding' field. Creates one document per collection.
-    Returns the number of documents written. Requires Atlas Vector Search index on schema_metadata.
+    Collections whose stored '_hash' matches are not re-embedded or rewritten.
+    Returns the number of documents indexed (written or already up to date). Requires Atlas Vector Search index on schema_metadata.
     """
+    invalidate_embedding_cache()
+    clear_context_cache()
     db = get_database()
-    coll_names = db.list_collection_names()
+    coll_names = _list_collection_names(db)
     # Skip RAG and system collections
     skip = {SCHEMA_RAG_COLLECTION, "query_examples", "system.indexes"}
     to_index = [c for c in coll_names if c not in skip and not c.startswith("system.")]
     if not to_index:
         return 0
-    texts = [_infer_schema_text(db, c, sample_size) for c in to_index]
-    embeddings = get_embeddings(texts)
+    # Sample collections concurrently; PyMongo releases the GIL on socket I/O and the client pool is shared
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        texts = list(ex.map(lambda c: _infer_schema_text(db, c, sample_size), to_index))
+    texts = [truncate_for_embedding(t) for t in texts]
+    hashes = [content_hash(t) for t in texts]
     collection = db[SCHEMA_RAG_COLLECTION]
-    written = 0
-    for name, text, emb in zip(to_index, texts, embeddings):
+    # Skip collections whose stored _hash matches: their schema text (and embedding) is unchanged
+    existing = {
+        d["collection_name"]: d.get("_hash")
+        for d in collection.find({"collection_name": {"$in": to_index}}, {"_id": 0, "collection_name": 1, "_hash": 1})
+    }
+    changed = [i for i, (name, h) in enumerate(zip(to_index, hashes)) if existing.get(name) != h]
+    unchanged = len(to_index) - len(changed)
+    if not changed:
+        return unchanged
+    unique = list(dict.fromkeys(texts[i] for i in changed))
+    emb_map = dict(zip(unique, get_embeddings(unique)))
+    ops = []
+    for i in changed:
+        emb = emb_map[texts[i]]
         if not emb:
             continue
         doc = {
-            "collection_name": name,
-            "text": text,
-            "embedding": emb,
+            "collection_name": to_index[i],
+            "text": texts[i],
+            "embedding": to_bson_vector(emb),
+            "_hash": hashes[i],
         }
-        collection.update_one(
-            {"collection_name": name},
-            {"$set": doc},
-            upsert=True,
-        )
-        written += 1
-    return written
+        ops.append(UpdateOne({"collection_name": to_index[i]}, {"$set": doc}, upsert=True))
+    if not ops:
+        return unchanged
+    result = collection.bulk_write(ops, ordered=False)
+    return unchanged + result.upserted_count + result.matched_count
@@ -0,0 +1,34 @@
+"""Server-side schema sampling shared by the schema RAG index and the schema tools."""
+
+
+def field_types_pipeline(sample_size: int, max_keys: int = 8, max_elem_keys: int = 5) -> list[dict]:
+    """Aggregation that returns only top-level field names and BSON type names for up to sample_size docs,
+    plus the first max_keys keys of embedded objects and the first max_elem_keys keys of the first element
+    of arrays of objects. Field values never leave the server."""
+    return [
+        {"$limit": sample_size},
+        {"$project": {"_id": 0, "fields": {"$map": {
+            "input": {"$objectToArray": "$$ROOT"},
+            "as": "kv",
+            "in": {
+                "k": "$$kv.k",
+                "t": {"$type": "$$kv.v"},
+                "keys": {"$cond": [
+                    {"$eq": [{"$type": "$$kv.v"}, "object"]},
+                    {"$slice": [{"$map": {"input": {"$objectToArray": "$$kv.v"}, "as": "s", "in": "$$s.k"}}, max_keys]},
+                    None,
+                ]},
+                "elem_keys": {"$cond": [
+                    {"$and": [
+                        {"$eq": [{"$type": "$$kv.v"}, "array"]},
+                        {"$eq": [{"$type": {"$arrayElemAt": ["$$kv.v", 0]}}, "object"]},
+                    ]},
+                    {"$slice": [
+                        {"$map": {"input": {"$objectToArray": {"$arrayElemAt": ["$$kv.v", 0]}}, "as": "s", "in": "$$s.k"}},
+                        max_elem_keys,
+                    ]},
+                    None,
+                ]},
+            },
+        }}}},
+    ]
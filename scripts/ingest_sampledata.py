@@ -13,6 +13,7 @@ Requires: MONGODB_URI, VOYAGE_API_KEY (for embeddings). Run from repo root or wi
 """
 from __future__ import annotations
 
+import functools
 import json
 import os
 import sys
@@ -22,7 +23,9 @@ _REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if _REPO_ROOT not in sys.path:
     sys.path.insert(0, _REPO_ROOT)
 
+import orjson
 from bson import json_util as bson_json_util
+from pymongo import WriteConcern
 
 from config import get_database, DB_NAME
 from rag import build_schema_index, build_query_examples_index
@@ -31,6 +34,9 @@ from rag.query_examples_index import load_default_examples
 # Path to sampledata directory (repo-relative)
 SAMPLEDATA_DIR = os.path.join(_REPO_ROOT, "sampledata")
 
+# Documents per insert_many call during ingest
+INSERT_BATCH_SIZE = 1000
+
 # File -> collection name
 FILE_TO_COLLECTION = {
     "datapod.json": "datapod",
@@ -55,9 +61,8 @@ INFERYX_QUERY_EXAMPLES = [
 ]
 
 
-def _parse_extended_json(s: str):
-    """Parse MongoDB extended JSON string (supports $oid, $date) into a Python object."""
-    return bson_json_util.loads(s)
+# Key prefix that marks MongoDB extended JSON ($oid, $date, $numberLong, ...)
+_EXTENDED_JSON_MARKER = b'"$'
 
 
 def _load_json_documents(path: str) -> list[dict]:
@@ -67,36 +72,42 @@ def _load_json_documents(path: str) -> list[dict]:
     - JSON array of objects
     - Concatenated JSON objects (one per block, separated by blank lines)
     Uses MongoDB extended JSON for _id.$oid and $date.
+    Plain JSON is parsed with orjson; bson.json_util is only used when extended-JSON keys are present.
     """
-    with open(path, "r", encoding="utf-8") as f:
-        raw = f.read()
-    raw = raw.strip()
-    if not raw:
+    with open(path, "rb") as f:
+        raw_bytes = f.read().strip()
+    if not raw_bytes:
         return []
+    extended = _EXTENDED_JSON_MARKER in raw_bytes
 
     # Try single object or array first
     try:
-        obj = _parse_extended_json(raw)
+        obj = bson_json_util.loads(raw_bytes) if extended else orjson.loads(raw_bytes)
         if isinstance(obj, list):
             return obj
         return [obj]
-    except json.JSONDecodeError:
+    except ValueError:  # json.JSONDecodeError and orjson.JSONDecodeError both subclass it
         pass
 
-    # Multiple top-level objects: use JSONDecoder.raw_decode to find boundaries (avoids splitting on nested braces)
+    # Multiple top-level objects: use JSONDecoder.raw_decode to find boundaries (avoids splitting on nested braces).
+    # The extended-JSON hook is applied while decoding, so each chunk is parsed exactly once.
+    raw = raw_bytes.decode("utf-8")
     docs = []
-    decoder = json.JSONDecoder()
+    if extended:
+        hook = functools.partial(bson_json_util.object_pairs_hook, json_options=bson_json_util.DEFAULT_JSON_OPTIONS)
+        decoder = json.JSONDecoder(object_pairs_hook=hook)
+    else:
+        decoder = json.JSONDecoder()
     pos = 0
     while pos < len(raw):
         pos = len(raw) - len(raw[pos:].lstrip())
         if pos >= len(raw):
             break
         try:
-            _, end = decoder.raw_decode(raw, pos)
+            doc, end = decoder.raw_decode(raw, pos)
         except json.JSONDecodeError as e:
             raise ValueError(f"Failed to parse at position {pos} in {path}: {e}") from e
-        chunk = raw[pos:end]
-        docs.append(_parse_extended_json(chunk))
+        docs.append(doc)
         pos = end
     return docs
 
@@ -106,13 +117,14 @@ def ingest_collection(db, collection_name: str, filepath: str, replace: bool = T
     Load JSON from filepath and insert into db[collection_name].
     If replace=True, drops existing collection and inserts fresh. Returns count inserted.
     """
-    coll = db[collection_name]
+    coll = db.get_collection(collection_name, write_concern=WriteConcern(w=1, j=False))
     if replace:
-        coll.delete_many({})
+        coll.drop()
     docs = _load_json_documents(filepath)
     if not docs:
         return 0
-    coll.insert_many(docs)
+    for i in range(0, len(docs), INSERT_BATCH_SIZE):
+        coll.insert_many(docs[i:i + INSERT_BATCH_SIZE], ordered=False, bypass_document_validation=True)
     return len(docs)
 
 
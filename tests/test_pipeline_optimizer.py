@@ -0,0 +1,306 @@
+"""Tests for the aggregation pipeline rewrites in tools/pipeline_optimizer.py."""
+import copy
+import unittest
+
+from tools.pipeline_optimizer import (
+    merge_adjacent_lookups,
+    optimize_pipeline,
+    push_match_before_lookup,
+    unwind_after_lookup,
+)
+
+LOOKUP = {"$lookup": {"from": "users", "localField": "userId", "foreignField": "_id", "as": "user"}}
+
+
+class PushMatchBeforeLookupTest(unittest.TestCase):
+    def assertSwapped(self, match):
+        self.assertEqual(push_match_before_lookup([LOOKUP, match]), [match, LOOKUP])
+
+    def assertKept(self, match):
+        self.assertEqual(push_match_before_lookup([LOOKUP, match]), [LOOKUP, match])
+
+    def test_swaps_filter_on_unrelated_field(self):
+        self.assertSwapped({"$match": {"status": "active"}})
+
+    def test_swaps_logical_operators_on_unrelated_fields(self):
+        self.assertSwapped({"$match": {"$or": [{"status": "active"}, {"total": {"$gt": 5}}]}})
+
+    def test_swaps_expr_on_unrelated_fields(self):
+        self.assertSwapped({"$match": {"$expr": {"$gt": ["$total", "$minTotal"]}}})
+
+    def test_keeps_filter_on_as_field(self):
+        self.assertKept({"$match": {"user": {"$ne": []}}})
+
+    def test_keeps_filter_on_child_of_as_field(self):
+        self.assertKept({"$match": {"user.name": "alice"}})
+
+    def test_keeps_filter_on_parent_of_as_field(self):
+        lookup = {"$lookup": {**LOOKUP["$lookup"], "as": "joined.user"}}
+        match = {"$match": {"joined": {"$exists": True}}}
+        self.assertEqual(push_match_before_lookup([lookup, match]), [lookup, match])
+
+    def test_keeps_logical_operator_touching_as_field(self):
+        self.assertKept({"$match": {"$and": [{"status": "active"}, {"user.name": "alice"}]}})
+
+    def test_keeps_expr_on_as_field(self):
+        self.assertKept({"$match": {"$expr": {"$gt": [{"$size": "$user"}, 0]}}})
+
+    def test_keeps_expr_with_implicit_get_field(self):
+        self.assertKept({"$match": {"$expr": {"$gt": [{"$size": {"$getField": "user"}}, 0]}}})
+        self.assertKept({"$match": {"$expr": {"$gt": [{"$getField": {"field": "status"}}, 0]}}})
+
+    def test_keeps_expr_on_root(self):
+        self.assertKept({"$match": {"$expr": {"$gt": [{"$size": {"$objectToArray": "$$ROOT"}}, 3]}}})
+
+    def test_keeps_text_and_where(self):
+        self.assertKept({"$match": {"$text": {"$search": "alice"}}})
+        self.assertKept({"$match": {"$where": "this.total > 5"}})
+
+    def test_bubbles_past_several_lookups(self):
+        other = {"$lookup": {"from": "items", "localField": "itemId", "foreignField": "_id", "as": "item"}}
+        match = {"$match": {"status": "active"}}
+        self.assertEqual(push_match_before_lookup([LOOKUP, other, match]), [match, LOOKUP, other])
+
+    def test_does_not_mutate_input(self):
+        pipeline = [LOOKUP, {"$match": {"status": "active"}}]
+        original = copy.deepcopy(pipeline)
+        optimize_pipeline(pipeline)
+        self.assertEqual(pipeline, original)
+
+
+def _get_path(value, path: str):
+    for part in path.split(".") if path else []:
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _eval(expr, doc: dict, variables: dict):
+    """Evaluate the small expression subset used below ($eq, $gt, $and, $or, $in, paths, variables)."""
+    if isinstance(expr, str) and expr.startswith("$$"):
+        name, _, rest = expr[2:].partition(".")
+        return _get_path(doc if name in ("ROOT", "CURRENT") else variables[name], rest)
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _get_path(doc, expr[1:])
+    if isinstance(expr, dict):
+        (op, args), = expr.items()
+        values = [_eval(a, doc, variables) for a in args]
+        if op == "$eq":
+            return values[0] == values[1]
+        if op == "$gt":
+            return values[0] is not None and values[1] is not None and values[0] > values[1]
+        if op == "$and":
+            return all(values)
+        if op == "$or":
+            return any(values)
+        if op == "$in":
+            return values[0] in (values[1] or [])
+        raise NotImplementedError(op)
+    return expr
+
+
+def _run_lookup(spec: dict, doc: dict, foreign: list[dict]) -> list[dict]:
+    variables = {k: _eval(v, doc, {}) for k, v in (spec.get("let") or {}).items()}
+    expr = spec["pipeline"][0]["$match"]["$expr"]
+    return [f for f in foreign if _eval(expr, f, variables)]
+
+
+def _run(pipeline: list, docs: list[dict], foreign: list[dict]) -> list[dict]:
+    """Run $lookup/$addFields($filter)/$unset stages on docs against one foreign collection."""
+    out = []
+    for doc in docs:
+        doc = dict(doc)
+        for stage in pipeline:
+            (op, spec), = stage.items()
+            if op == "$lookup":
+                doc[spec["as"]] = _run_lookup(spec, doc, foreign)
+            elif op == "$addFields":
+                for field, f in spec.items():
+                    f = f["$filter"]
+                    doc[field] = [x for x in _get_path(doc, f["input"][1:]) if _eval(f["cond"], doc, {f["as"]: x})]
+            elif op == "$unset":
+                doc.pop(spec, None)
+        out.append(doc)
+    return out
+
+
+def _expr_lookup(as_field: str, expr, let: dict | None = None, from_: str = "products") -> dict:
+    spec = {"from": from_, "pipeline": [{"$match": {"$expr": expr}}], "as": as_field}
+    if let is not None:
+        spec["let"] = let
+    return {"$lookup": spec}
+
+
+PRODUCTS = [
+    {"_id": 1, "sku": "a", "vendor": 10, "price": 5},
+    {"_id": 2, "sku": "b", "vendor": 20, "price": 50},
+    {"_id": 3, "sku": "c", "vendor": 10, "price": 500},
+]
+ORDERS = [
+    {"_id": 100, "sku": "a", "vendorId": 10, "terms": {"vendorId": 10, "minPrice": 0}},
+    {"_id": 101, "sku": "b", "vendorId": 10, "terms": {"vendorId": 10, "minPrice": 100}},
+    {"_id": 102, "sku": "z", "vendorId": 30, "terms": {"vendorId": 30, "minPrice": 0}},
+]
+
+
+class MergeAdjacentLookupsTest(unittest.TestCase):
+    def assertMergedEquivalent(self, pipeline):
+        merged = merge_adjacent_lookups(pipeline)
+        self.assertEqual(len(merged), 3)
+        self.assertEqual(sum(1 for s in merged if "$lookup" in s), 1)
+        self.assertEqual(_run(merged, ORDERS, PRODUCTS), _run(pipeline, ORDERS, PRODUCTS))
+
+    def assertNotMerged(self, pipeline):
+        self.assertEqual(merge_adjacent_lookups(pipeline), pipeline)
+
+    def test_merges_lookups_with_shared_let(self):
+        self.assertMergedEquivalent([
+            _expr_lookup("product", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"}),
+            _expr_lookup("vendorProducts", {"$eq": ["$vendor", "$$vendor"]}, {"vendor": "$vendorId"}),
+        ])
+
+    def test_merges_compound_conditions_and_let_paths(self):
+        self.assertMergedEquivalent([
+            _expr_lookup(
+                "pricey",
+                {"$and": [{"$eq": ["$vendor", "$$t.vendorId"]}, {"$gt": ["$price", "$$t.minPrice"]}]},
+                {"t": "$terms"},
+            ),
+            _expr_lookup("same", {"$eq": ["$$ROOT.sku", "$$sku"]}, {"sku": "$sku"}),
+        ])
+
+    def test_refuses_different_collections(self):
+        self.assertNotMerged([
+            _expr_lookup("a", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"}),
+            _expr_lookup("b", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"}, from_="vendors"),
+        ])
+
+    def test_refuses_local_field_lookups(self):
+        self.assertNotMerged([
+            {"$lookup": {"from": "products", "localField": "sku", "foreignField": "sku", "as": "a"}},
+            _expr_lookup("b", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"}),
+        ])
+
+    def test_refuses_multi_stage_or_non_expr_pipelines(self):
+        multi = _expr_lookup("a", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"})
+        multi["$lookup"]["pipeline"].append({"$limit": 1})
+        plain = {"$lookup": {"from": "products", "pipeline": [{"$match": {"price": 5}}], "as": "a"}}
+        second = _expr_lookup("b", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"})
+        self.assertNotMerged([multi, second])
+        self.assertNotMerged([plain, second])
+
+    def test_refuses_same_as_field(self):
+        self.assertNotMerged([
+            _expr_lookup("a", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"}),
+            _expr_lookup("a", {"$eq": ["$vendor", "$$v"]}, {"v": "$vendorId"}),
+        ])
+
+    def test_refuses_conflicting_let_names(self):
+        self.assertNotMerged([
+            _expr_lookup("a", {"$eq": ["$sku", "$$x"]}, {"x": "$sku"}),
+            _expr_lookup("b", {"$eq": ["$vendor", "$$x"]}, {"x": "$vendorId"}),
+        ])
+
+    def test_refuses_second_lookup_reading_first_output(self):
+        first = _expr_lookup("a", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"})
+        self.assertNotMerged([first, _expr_lookup("b", {"$in": ["$sku", "$$skus"]}, {"skus": "$a.sku"})])
+        self.assertNotMerged([first, _expr_lookup("b", {"$in": ["$sku", "$$skus"]}, {"skus": {"$getField": "a"}})])
+
+    def test_refuses_binding_and_field_name_operators(self):
+        second = _expr_lookup("b", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"})
+        for expr in (
+            {"$eq": [{"$let": {"vars": {"s": "$sku"}, "in": "$$s"}}, "$$sku"]},
+            {"$eq": ["$sku", {"$literal": "$sku"}]},
+            {"$eq": [{"$getField": "sku"}, "$$sku"]},
+            {"$eq": [{"$getField": {"field": "sku", "input": "$$ROOT"}}, "$$sku"]},
+            {"$eq": [{"$setField": {"field": "x", "input": "$$ROOT", "value": 1}}, "$$sku"]},
+        ):
+            with self.subTest(expr=expr):
+                self.assertNotMerged([_expr_lookup("a", expr, {"sku": "$sku"}), second])
+
+    def test_refuses_path_into_computed_let(self):
+        self.assertNotMerged([
+            _expr_lookup("a", {"$eq": ["$sku", "$$o.sku"]}, {"o": {"$mergeObjects": ["$$ROOT", {}]}}),
+            _expr_lookup("b", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"}),
+        ])
+
+    def test_refuses_reserved_merged_field(self):
+        self.assertNotMerged([
+            _expr_lookup("__merged_lookup", {"$eq": ["$sku", "$$sku"]}, {"sku": "$sku"}),
+            _expr_lookup("b", {"$eq": ["$vendor", "$$v"]}, {"v": "$vendorId"}),
+        ])
+
+
+class UnwindAfterLookupTest(unittest.TestCase):
+    def assertMoved(self, between, unwind="$user"):
+        unwind_stage = {"$unwind": unwind}
+        self.assertEqual(
+            unwind_after_lookup([LOOKUP, *between, unwind_stage]),
+            [LOOKUP, unwind_stage, *between],
+        )
+
+    def assertKept(self, between, unwind="$user"):
+        pipeline = [LOOKUP, *between, {"$unwind": unwind}]
+        self.assertEqual(unwind_after_lookup(pipeline), pipeline)
+
+    def test_moves_past_unrelated_match(self):
+        self.assertMoved([{"$match": {"status": "active"}}])
+
+    def test_moves_past_unrelated_add_fields_set_and_unset(self):
+        self.assertMoved([
+            {"$addFields": {"total": {"$add": ["$price", "$tax"]}}},
+            {"$set": {"flag": True}},
+            {"$unset": ["tmp", "other"]},
+        ])
+
+    def test_moves_document_form_unwind(self):
+        self.assertMoved([{"$match": {"status": "active"}}], {"path": "$user", "preserveNullAndEmptyArrays": True})
+
+    def test_leaves_adjacent_unwind_alone(self):
+        pipeline = [LOOKUP, {"$unwind": "$user"}, {"$match": {"status": "active"}}]
+        self.assertEqual(unwind_after_lookup(pipeline), pipeline)
+
+    def test_keeps_when_stage_reads_as_field(self):
+        self.assertKept([{"$match": {"user.name": "alice"}}])
+        self.assertKept([{"$addFields": {"n": {"$size": "$user"}}}])
+        self.assertKept([{"$addFields": {"n": {"$size": {"$getField": "user"}}}}])
+        self.assertKept([{"$addFields": {"n": {"$size": {"$getField": {"field": "user"}}}}}])
+
+    def test_keeps_when_stage_writes_as_field(self):
+        self.assertKept([{"$set": {"user": []}}])
+        self.assertKept([{"$addFields": {"user.name": "x"}}])
+        self.assertKept([{"$unset": "user"}])
+
+    def test_keeps_when_stage_reads_whole_document(self):
+        self.assertKept([{"$addFields": {"copy": "$$ROOT"}}])
+        self.assertKept([{"$addFields": {"n": {"$getField": {"field": {"$literal": "user"}}}}}])
+        self.assertKept([{"$addFields": {"d": {"$setField": {"field": "x", "input": "$other", "value": 1}}}}])
+        self.assertKept([{"$addFields": {"d": {"$unsetField": {"field": "x", "input": "$other"}}}}])
+
+    def test_keeps_behind_blocking_stages(self):
+        for stage in (
+            {"$group": {"_id": "$status"}},
+            {"$sort": {"total": -1}},
+            {"$limit": 5},
+            {"$project": {"user": 1}},
+            {"$match": {"$text": {"$search": "alice"}}},
+        ):
+            with self.subTest(stage=stage):
+                self.assertKept([stage])
+
+    def test_include_array_index_field_is_guarded(self):
+        unwind = {"path": "$user", "includeArrayIndex": "userIdx"}
+        self.assertMoved([{"$match": {"status": "active"}}], unwind)
+        self.assertKept([{"$match": {"userIdx": 0}}], unwind)
+        self.assertKept([{"$set": {"userIdx": 1}}], unwind)
+
+    def test_ignores_unwind_of_other_field(self):
+        pipeline = [LOOKUP, {"$match": {"status": "active"}}, {"$unwind": "$items"}]
+        self.assertEqual(unwind_after_lookup(pipeline), pipeline)
+
+    def test_project_dropping_as_field_is_left_in_place(self):
+        pipeline = [LOOKUP, {"$project": {"user": 0}}, {"$unwind": "$user"}]
+        self.assertEqual(unwind_after_lookup(pipeline), pipeline)
+
+
+if __name__ == "__main__":
+    unittest.main()
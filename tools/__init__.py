@@ -1,4 +1,4 @@
-from .schema_tools import get_list_collections_tool, get_collection_schema_tool
+from .schema_tools import get_list_collections_tool, get_collection_schema_tool, get_collection_schemas_tool
 from .query_tools import get_execute_find_tool, get_execute_aggregation_tool
 
 
@@ -7,6 +7,7 @@ def get_all_tools(db):
     return [
         get_list_collections_tool(db),
         get_collection_schema_tool(db),
+        get_collection_schemas_tool(db),
         get_execute_find_tool(db),
         get_execute_aggregation_tool(db),
     ]
@@ -0,0 +1,310 @@
+"""Rule-based rewrites for LLM-authored aggregation pipelines, applied before execution."""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Query operators whose operands are lists of sub-filters
+_LOGICAL_OPS = {"$and", "$or", "$nor"}
+
+
+def _expr_fields(expr, out: set) -> None:
+    """Collect field paths referenced as "$field" strings or implicit $getField names inside an aggregation expression."""
+    if isinstance(expr, str):
+        if expr.startswith(("$$ROOT", "$$CURRENT")):
+            out.add(expr)  # whole-document reference; rejected by _match_fields
+        elif expr.startswith("$") and not expr.startswith("$$"):
+            out.add(expr[1:])
+    elif isinstance(expr, dict):
+        for k, v in expr.items():
+            if k == "$getField" and _implicit_get_field(v):
+                # {"$getField": "name"} / {"$getField": {"field": "name"}} read a field of the current document
+                name = v if isinstance(v, str) else v.get("field")
+                out.add(name if isinstance(name, str) and not name.startswith("$") else "$$CURRENT")
+            else:
+                _expr_fields(v, out)
+    elif isinstance(expr, list):
+        for v in expr:
+            _expr_fields(v, out)
+
+
+def _implicit_get_field(spec) -> bool:
+    """True for a $getField argument without "input", i.e. one that reads the current document."""
+    return isinstance(spec, str) or (isinstance(spec, dict) and "input" not in spec)
+
+
+def _has_implicit_get_field(expr) -> bool:
+    if isinstance(expr, dict):
+        return any(
+            (k == "$getField" and _implicit_get_field(v)) or _has_implicit_get_field(v) for k, v in expr.items()
+        )
+    if isinstance(expr, list):
+        return any(_has_implicit_get_field(v) for v in expr)
+    return False
+
+
+def _has_field_name_op(expr) -> bool:
+    """True if expr uses $setField/$unsetField anywhere."""
+    if isinstance(expr, dict):
+        return any(k in ("$setField", "$unsetField") or _has_field_name_op(v) for k, v in expr.items())
+    if isinstance(expr, list):
+        return any(_has_field_name_op(v) for v in expr)
+    return False
+
+
+def _match_fields(query: dict) -> set | None:
+    """Return the field paths a $match filter reads, or None if they cannot be determined safely."""
+    fields = set()
+    for key, value in query.items():
+        if key in _LOGICAL_OPS:
+            if not isinstance(value, list):
+                return None
+            for sub in value:
+                sub_fields = _match_fields(sub) if isinstance(sub, dict) else None
+                if sub_fields is None:
+                    return None
+                fields |= sub_fields
+        elif key == "$expr":
+            if _has_implicit_get_field(value):
+                return None  # {"$getField": "name"} reads a field without a "$name" path
+            _expr_fields(value, fields)
+            if any(f.startswith("$$") for f in fields):
+                return None
+        elif key.startswith("$"):
+            # $text, $where, $comment, ... : not safe to reason about
+            return None
+        else:
+            fields.add(key)
+    return fields
+
+
+def _references(fields: set, path: str) -> bool:
+    """True if any field path is path itself, inside it, or a parent of it."""
+    return any(f == path or f.startswith(path + ".") or path.startswith(f + ".") for f in fields)
+
+
+def _stage_op(stage) -> str | None:
+    if isinstance(stage, dict) and len(stage) == 1:
+        return next(iter(stage))
+    return None
+
+
+def push_match_before_lookup(pipeline: list) -> list:
+    """Move each $match that directly follows a $lookup ahead of it when the filter does not read
+    the lookup's "as" field, so documents are filtered before they are joined. Repeats until no
+    such pair remains, letting a $match bubble past several $lookups. Returns a new list."""
+    pipeline = list(pipeline)
+    changed = True
+    while changed:
+        changed = False
+        for i in range(len(pipeline) - 1):
+            lookup, match = pipeline[i], pipeline[i + 1]
+            if _stage_op(lookup) != "$lookup" or _stage_op(match) != "$match":
+                continue
+            as_field = lookup["$lookup"].get("as")
+            query = match["$match"]
+            fields = _match_fields(query) if isinstance(query, dict) else None
+            if not isinstance(as_field, str) or fields is None or _references(fields, as_field):
+                continue
+            pipeline[i], pipeline[i + 1] = match, lookup
+            logger.info("Pipeline rewrite: moved $match on %s before $lookup into %r", sorted(fields), as_field)
+            changed = True
+    return pipeline
+
+
+# Operators that bind their own variables; expressions using them are not rewritten
+_BINDING_OPS = {"$let", "$map", "$filter", "$reduce", "$sortArray"}
+
+# Operators that name fields as plain strings (and may read the current document implicitly)
+_FIELD_NAME_OPS = {"$getField", "$setField", "$unsetField"}
+
+# Variable bound to each joined document when splitting a merged $lookup result
+_DOC_VAR = "lookupDoc"  # user variable names must start with a lowercase letter
+_MERGED_FIELD = "__merged_lookup"
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _single_expr_match(lookup: dict):
+    """Return E if lookup is a pipeline-style $lookup whose pipeline is exactly [{"$match": {"$expr": E}}]."""
+    if "localField" in lookup or "foreignField" in lookup:
+        return None
+    stages = lookup.get("pipeline")
+    if not isinstance(stages, list) or len(stages) != 1 or _stage_op(stages[0]) != "$match":
+        return None
+    query = stages[0]["$match"]
+    if not isinstance(query, dict) or list(query) != ["$expr"]:
+        return None
+    return query["$expr"]
+
+
+def _to_outer_expr(expr, let: dict):
+    """Rewrite an expression evaluated on foreign documents inside a $lookup pipeline so it can run in
+    an outer $filter: "$field" -> "$$lookupDoc.field", "$$var" -> the lookup's let expression."""
+    if isinstance(expr, str):
+        if expr.startswith("$$"):
+            name, _, rest = expr[2:].partition(".")
+            if name in ("ROOT", "CURRENT"):
+                return f"$${_DOC_VAR}" + (f".{rest}" if rest else "")
+            if name in let:
+                value = let[name]
+                if not rest:
+                    return value
+                if isinstance(value, str) and value.startswith("$") and not value.startswith("$$"):
+                    return f"{value}.{rest}"
+                raise _Unsupported(expr)
+            return expr
+        if expr.startswith("$"):
+            return f"$${_DOC_VAR}.{expr[1:]}"
+        return expr
+    if isinstance(expr, dict):
+        if (_BINDING_OPS | _FIELD_NAME_OPS) & expr.keys() or "$literal" in expr:
+            raise _Unsupported(expr)
+        return {k: _to_outer_expr(v, let) for k, v in expr.items()}
+    if isinstance(expr, list):
+        return [_to_outer_expr(v, let) for v in expr]
+    return expr
+
+
+def _merge_lookup_pair(first: dict, second: dict) -> list | None:
+    """Combine two $lookup stages on the same collection whose pipelines are single $expr matches into
+    one $lookup with a disjunctive match, then split the joined docs back into the two "as" fields."""
+    a, b = first["$lookup"], second["$lookup"]
+    if a.get("from") != b.get("from") or not isinstance(a.get("from"), str):
+        return None
+    expr_a, expr_b = _single_expr_match(a), _single_expr_match(b)
+    as_a, as_b = a.get("as"), b.get("as")
+    if expr_a is None or expr_b is None or not isinstance(as_a, str) or not isinstance(as_b, str) or as_a == as_b:
+        return None
+    let_a, let_b = a.get("let") or {}, b.get("let") or {}
+    if any(k in let_a and let_a[k] != v for k, v in let_b.items()):
+        return None
+    # The second lookup must not depend on the first one's output
+    fields = set()
+    _expr_fields(let_b, fields)
+    if _references(fields, as_a) or _has_implicit_get_field(let_b) or _MERGED_FIELD in (as_a, as_b):
+        return None
+    try:
+        cond_a, cond_b = _to_outer_expr(expr_a, let_a), _to_outer_expr(expr_b, let_b)
+    except _Unsupported:
+        return None
+    return [
+        {"$lookup": {
+            "from": a["from"],
+            "let": {**let_a, **let_b},
+            "pipeline": [{"$match": {"$expr": {"$or": [expr_a, expr_b]}}}],
+            "as": _MERGED_FIELD,
+        }},
+        {"$addFields": {
+            as_a: {"$filter": {"input": f"${_MERGED_FIELD}", "as": _DOC_VAR, "cond": cond_a}},
+            as_b: {"$filter": {"input": f"${_MERGED_FIELD}", "as": _DOC_VAR, "cond": cond_b}},
+        }},
+        {"$unset": _MERGED_FIELD},
+    ]
+
+
+def merge_adjacent_lookups(pipeline: list) -> list:
+    """Replace adjacent $lookup pairs on the same foreign collection (each with a single $expr $match
+    pipeline) by one $lookup, so the foreign collection is scanned once. Returns a new list."""
+    out = []
+    i = 0
+    while i < len(pipeline):
+        if i + 1 < len(pipeline) and _stage_op(pipeline[i]) == _stage_op(pipeline[i + 1]) == "$lookup":
+            merged = _merge_lookup_pair(pipeline[i], pipeline[i + 1])
+            if merged is not None:
+                logger.info(
+                    "Pipeline rewrite: merged $lookups into %r and %r from %r",
+                    pipeline[i]["$lookup"]["as"], pipeline[i + 1]["$lookup"]["as"], pipeline[i]["$lookup"]["from"],
+                )
+                out.extend(merged)
+                i += 2
+                continue
+        out.append(pipeline[i])
+        i += 1
+    return out
+
+
+def _unwind_path(stage) -> tuple[str, str | None] | None:
+    """Return (field, includeArrayIndex) for an $unwind stage, or None."""
+    if _stage_op(stage) != "$unwind":
+        return None
+    spec = stage["$unwind"]
+    path = spec if isinstance(spec, str) else spec.get("path") if isinstance(spec, dict) else None
+    if not isinstance(path, str) or not path.startswith("$") or path.startswith("$$"):
+        return None
+    index_field = spec.get("includeArrayIndex") if isinstance(spec, dict) else None
+    return path[1:], index_field
+
+
+def _commutes_with_unwind(stage, fields: list[str]) -> bool:
+    """True if stage is a per-document stage that neither reads nor writes any of fields, so it can
+    run after an $unwind instead of before it."""
+    op = _stage_op(stage)
+    if op == "$match":
+        read = _match_fields(stage["$match"]) if isinstance(stage["$match"], dict) else None
+        return read is not None and not any(_references(read, f) for f in fields)
+    if op in ("$addFields", "$set"):
+        spec = stage[op]
+        if not isinstance(spec, dict):
+            return False
+        if _has_field_name_op(spec):
+            return False
+        read = set()
+        _expr_fields(spec, read)
+        if any(r.startswith("$$") for r in read):
+            return False
+        touched = read | set(spec)
+        return not any(_references(touched, f) for f in fields)
+    if op == "$unset":
+        names = stage["$unset"]
+        names = [names] if isinstance(names, str) else names
+        return isinstance(names, list) and not any(_references(set(names), f) for f in fields)
+    return False
+
+
+def _project_drops(stage, field: str) -> bool:
+    """True if stage is a $project that discards field."""
+    if _stage_op(stage) != "$project" or not isinstance(stage["$project"], dict):
+        return False
+    spec = stage["$project"]
+    if spec.get(field) in (0, False):
+        return True
+    inclusive = any(v not in (0, False) for k, v in spec.items() if k != "_id")
+    return inclusive and not _references(set(spec), field)
+
+
+def unwind_after_lookup(pipeline: list) -> list:
+    """Move an $unwind of a $lookup's "as" field up to directly follow the $lookup when only
+    commuting stages sit between them, so the server can fuse $lookup + $unwind and never
+    materialize the joined array. Returns a new list."""
+    pipeline = list(pipeline)
+    for i, stage in enumerate(pipeline):
+        if _stage_op(stage) != "$lookup":
+            continue
+        as_field = stage["$lookup"].get("as")
+        if not isinstance(as_field, str):
+            continue
+        for j in range(i + 1, len(pipeline)):
+            unwind = _unwind_path(pipeline[j])
+            if unwind is not None and unwind[0] == as_field:
+                guarded = [as_field] + ([unwind[1]] if unwind[1] else [])
+                if j > i + 1 and all(_commutes_with_unwind(s, guarded) for s in pipeline[i + 1:j]):
+                    pipeline.insert(i + 1, pipeline.pop(j))
+                    logger.info("Pipeline rewrite: moved $unwind of %r next to its $lookup", as_field)
+                break
+            if _project_drops(pipeline[j], as_field):
+                if all(_commutes_with_unwind(s, [as_field]) for s in pipeline[i + 1:j]):
+                    logger.info(
+                        "Pipeline hint: $lookup into %r is discarded by a later $project; the join can be removed",
+                        as_field,
+                    )
+                break
+    return pipeline
+
+
+def optimize_pipeline(pipeline: list) -> list:
+    """Apply all rewrites. Never mutates the input list or its stages."""
+    pipeline = push_match_before_lookup(pipeline)
+    pipeline = merge_adjacent_lookups(pipeline)
+    return unwind_after_lookup(pipeline)
@@ -1,18 +1,124 @@
 """Tools for executing MongoDB find and aggregation (including $lookup joins)."""
-import json
-from bson import ObjectId
+import base64
+import functools
+import queue
+import threading
+
+import orjson
+from bson import Binary, Decimal128, ObjectId
+from bson.binary import UUID_SUBTYPE
 from langchain_core.tools import tool
 
+from .pipeline_optimizer import optimize_pipeline
+
 
-def _serialize(obj):
-    """Convert MongoDB types to JSON-serializable (e.g. ObjectId -> str)."""
-    if isinstance(obj, ObjectId):
+def _default(obj):
+    """orjson fallback for BSON types it cannot encode (datetime is handled natively).
+    Dispatches on exact type, most frequent first; PyMongo decodes to these exact classes."""
+    t = type(obj)
+    if t is ObjectId or t is Decimal128:
         return str(obj)
-    if isinstance(obj, dict):
-        return {k: _serialize(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [_serialize(v) for v in obj]
-    return obj
+    if t is Binary:
+        return str(obj.as_uuid()) if obj.subtype == UUID_SUBTYPE else base64.b64encode(obj).decode()
+    if t is bytes:
+        return base64.b64encode(obj).decode()
+    return str(obj)
+
+
+_PREFETCH_DEPTH = 256
+_END = object()
+
+
+def _prefetched(cursor):
+    """Iterate cursor on a background thread, so getMore round-trips for later batches overlap with
+    encoding of earlier documents. Exceptions from the cursor are re-raised in the caller."""
+    q: queue.Queue = queue.Queue(maxsize=_PREFETCH_DEPTH)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for doc in cursor:
+                if not put(doc):
+                    return
+            put(_END)
+        except Exception as e:
+            put(e)
+        finally:
+            if stop.is_set():
+                cursor.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is _END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+_NO_DOCUMENTS = "(no documents)"
+
+
+def _dumps_cursor(cursor) -> str:
+    """Serialize a cursor's documents as NDJSON (one compact JSON document per line), encoding each
+    document as it arrives instead of materializing the full result list first. No indentation: the
+    output is read by the LLM, and whitespace only costs tokens."""
+    docs = iter(cursor)
+    first = next(docs, None)
+    if first is None:
+        return _NO_DOCUMENTS
+    buf = bytearray(orjson.dumps(first, default=_default, option=orjson.OPT_NON_STR_KEYS))
+    for doc in docs:
+        buf += b"\n"
+        buf += orjson.dumps(doc, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return buf.decode()
+
+
+# Agents often resend identical filter/pipeline strings; parse results are cached on the raw string.
+# Cached objects are shared, so callers must not mutate them.
+@functools.lru_cache(maxsize=256)
+def _parse_json(text: str):
+    """Parse a JSON tool argument; blank means {}."""
+    text = text.strip()
+    return orjson.loads(text) if text else {}
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_pipeline(text: str) -> tuple | None:
+    """Parse and optimize a pipeline argument. Returns None if it is not a JSON array."""
+    pipeline = orjson.loads(text)
+    if not isinstance(pipeline, list):
+        return None
+    return tuple(optimize_pipeline(pipeline))
+
+
+# Stages that can emit more documents than they receive
+_EXPANDING_STAGES = {"$unwind", "$unionWith", "$densify"}
+
+
+def _effective_limit(pipeline: list) -> int | None:
+    """Result-size bound of a pipeline: the value of its last $limit stage, if no stage after it can
+    add documents (e.g. [$limit 5, $lookup, $unwind] may return far more than 5)."""
+    for stage in reversed(pipeline):
+        if _EXPANDING_STAGES & stage.keys():
+            return None
+        limit = stage.get("$limit")
+        if isinstance(limit, int) and limit > 0:
+            return limit
+    return None
 
 
 def get_execute_find_tool(db):
@@ -26,16 +132,21 @@ def get_execute_find_tool(db):
             filter_json: JSON object for the query filter (e.g. '{"status": "active"}' or '{}' for all).
             projection_json: Optional JSON object for projection (e.g. '{"name": 1, "email": 1, "_id": 0}').
             limit: Maximum number of documents to return (default 50).
+        Returns matching documents as NDJSON: one JSON document per line, or "(no documents)".
         """
         try:
-            filt = json.loads(filter_json) if filter_json.strip() else {}
-            proj = json.loads(projection_json) if projection_json.strip() else {}
+            filt = _parse_json(filter_json)
+            stripped = projection_json.strip()
+            # No projection for the common "{}" without parsing; an empty dict would make PyMongo return only _id
+            proj = None if stripped in ("", "{}") else (_parse_json(stripped) or None)
             coll = db[collection_name]
-            cursor = coll.find(filt, proj if proj else None).limit(limit)
-            docs = list(cursor)
-            serialized = _serialize(docs)
-            return json.dumps(serialized, indent=2, default=str)
-        except json.JSONDecodeError as e:
+            # batch_size == limit returns everything in the first reply (no getMore round-trip);
+            # a negative limit already means "single batch" and batch_size() rejects negatives
+            cursor = coll.find(filt, proj).limit(limit)
+            if limit > 0:
+                cursor = cursor.batch_size(limit)
+            return _dumps_cursor(cursor)
+        except orjson.JSONDecodeError as e:
             return f"Invalid JSON in filter or projection: {e}"
         except Exception as e:
             return f"Error executing find: {e}"
@@ -54,20 +165,25 @@ def get_execute_aggregation_tool(db):
             collection_name: Name of the primary collection to run the pipeline on.
             pipeline_json: JSON array of aggregation stages (e.g. '[{"$match": {"status": "active"}}, {"$lookup": {"from": "users", "localField": "userId", "foreignField": "_id", "as": "user"}}, {"$limit": 20}]').
             limit_results: Optional cap on result size; add a $limit stage if your pipeline does not include one (default 100).
+        Returns result documents as NDJSON: one JSON document per line, or "(no documents)".
         """
         try:
-            pipeline = json.loads(pipeline_json)
-            if not isinstance(pipeline, list):
+            stages = _parse_pipeline(pipeline_json)
+            if stages is None:
                 return "pipeline_json must be a JSON array of stages."
+            pipeline = list(stages)
             has_limit = any(s.get("$limit") is not None for s in pipeline)
             if not has_limit and limit_results:
-                pipeline = pipeline + [{"$limit": limit_results}]
+                pipeline.append({"$limit": limit_results})  # pipeline is a fresh list, not the cached tuple
             coll = db[collection_name]
-            cursor = coll.aggregate(pipeline)
-            docs = list(cursor)
-            serialized = _serialize(docs)
-            return json.dumps(serialized, indent=2, default=str)
-        except json.JSONDecodeError as e:
+            batch_size = _effective_limit(pipeline)
+            # batchSize == the final $limit returns the whole result in the first reply (no getMore)
+            kwargs = {"batchSize": batch_size} if batch_size else {}
+            cursor = coll.aggregate(pipeline, **kwargs)
+            # A live server cursor after the first reply means more batches to fetch: overlap those
+            # getMores with encoding. Single-batch results skip the thread.
+            return _dumps_cursor(_prefetched(cursor) if cursor.cursor_id else cursor)
+        except orjson.JSONDecodeError as e:
             return f"Invalid JSON pipeline: {e}"
         except Exception as e:
             return f"Error executing aggregation: {e}"
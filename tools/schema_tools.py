@@ -1,6 +1,15 @@
 """Tools for discovering database and collection schema."""
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
 from langchain_core.tools import tool
 
+from schema_sampling import field_types_pipeline
+from ttl_cache import TTLCache
+
+# Schema changes are rare, while agents re-ask for the same schema across turns; keep tool output briefly.
+_schema_cache = TTLCache(max_size=128, ttl_seconds=60)
+
 
 def get_list_collections_tool(db):
     """Return a tool that lists collection names in the inferyx database."""
@@ -9,14 +18,45 @@ def get_list_collections_tool(db):
     def list_collections() -> str:
         """List all collection names in the inferyx database. Call this first to know which collections exist before querying or building aggregations."""
         try:
-            names = db.list_collection_names()
-            return f"Collections in database 'inferyx': {', '.join(names) or 'None'}"
+            names = _schema_cache.get_or_compute(("collections", db.name), lambda: ", ".join(db.list_collection_names()))
+            return f"Collections in database 'inferyx': {names or 'None'}"
         except Exception as e:
             return f"Error listing collections: {e}"
 
     return list_collections
 
 
+def _describe_collection(db, collection_name: str, sample_size: int) -> str:
+    """Describe field names and types of up to sample_size documents of a collection."""
+    coll = db[collection_name]
+    docs = list(coll.aggregate(field_types_pipeline(sample_size)))
+    if not docs:
+        return f"Collection '{collection_name}' is empty or does not exist."
+    lines = [f"Collection: {collection_name}", f"Sample size: {len(docs)}", ""]
+    for i, doc in enumerate(docs):
+        lines.append(f"--- Document {i + 1} ---")
+        for f in doc["fields"]:
+            t = f["t"]
+            if f.get("keys") is not None:
+                t += f" (keys: {f['keys']})"
+            elif f.get("elem_keys") is not None:
+                t += f" (list of dicts, first keys: {f['elem_keys']})"
+            lines.append(f"  {f['k']}: {t}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def _collection_schema(db, collection_name: str, sample_size: int) -> str:
+    """Cached schema description, or an error message."""
+    try:
+        return _schema_cache.get_or_compute(
+            ("schema", db.name, collection_name, sample_size),
+            lambda: _describe_collection(db, collection_name, sample_size),
+        )
+    except Exception as e:
+        return f"Error getting schema for '{collection_name}': {e}"
+
+
 def get_collection_schema_tool(db):
     """Return a tool that describes a collection's schema (field names and types from sample documents)."""
 
@@ -27,25 +67,26 @@ def get_collection_schema_tool(db):
             collection_name: Exact name of the collection (e.g. 'users', 'orders').
             sample_size: Number of documents to sample for schema inference (default 3).
         """
-        try:
-            coll = db[collection_name]
-            cursor = coll.find().limit(sample_size)
-            docs = list(cursor)
-            if not docs:
-                return f"Collection '{collection_name}' is empty or does not exist."
-            lines = [f"Collection: {collection_name}", f"Sample size: {len(docs)}", ""]
-            for i, doc in enumerate(docs):
-                lines.append(f"--- Document {i + 1} ---")
-                for k, v in doc.items():
-                    t = type(v).__name__
-                    if isinstance(v, dict):
-                        t += f" (keys: {list(v.keys())[:8]})"
-                    elif isinstance(v, list) and v and isinstance(v[0], dict):
-                        t += f" (list of dicts, first keys: {list(v[0].keys())[:5]})"
-                    lines.append(f"  {k}: {t}")
-                lines.append("")
-            return "\n".join(lines)
-        except Exception as e:
-            return f"Error getting schema for '{collection_name}': {e}"
+        return _collection_schema(db, collection_name, sample_size)
 
     return get_collection_schema
+
+
+def get_collection_schemas_tool(db):
+    """Return a tool that describes several collections' schemas in one call, sampling them concurrently."""
+
+    @tool
+    def get_collection_schemas(collection_names: List[str], sample_size: int = 3) -> str:
+        """Get the schemas of several collections at once by sampling documents. Prefer this over repeated get_collection_schema calls, e.g. to see both sides of a $lookup join.
+        Args:
+            collection_names: Exact names of the collections (e.g. ['users', 'orders']).
+            sample_size: Number of documents to sample per collection (default 3).
+        """
+        if not collection_names:
+            return "No collection names given."
+        # PyMongo releases the GIL during socket I/O, so sampling threads overlap their round-trips
+        with ThreadPoolExecutor(max_workers=min(8, len(collection_names))) as ex:
+            results = list(ex.map(lambda name: _collection_schema(db, name, sample_size), collection_names))
+        return "\n".join(results)
+
+    return get_collection_schemas